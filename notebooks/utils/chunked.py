@@ -0,0 +1,305 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+from utils.combine import check_all_ran_values, fill_nans_with_zero, dummy_fastest_lap_compound
+
+def reset_spill_dir(spill_dir):
+    """
+    Create the spill directory if needed and remove any chunk files left over from a previous build
+
+    Args:
+        spill_dir (str): Directory the weekend chunks are spilled to
+    """
+    os.makedirs(spill_dir, exist_ok=True)
+    for file_name in os.listdir(spill_dir):
+        if file_name.startswith('chunk_') and file_name.endswith('.pkl'):
+            os.remove(os.path.join(spill_dir, file_name))
+
+def list_spill_files(spill_dir):
+    """
+    List the spilled chunk files in the order they were written
+
+    Args:
+        spill_dir (str): Directory the weekend chunks are spilled to
+
+    Returns:
+        list: Paths of the chunk files
+    """
+    file_names = sorted(f for f in os.listdir(spill_dir) if f.startswith('chunk_') and f.endswith('.pkl'))
+    return [os.path.join(spill_dir, f) for f in file_names]
+
+def iter_spill_chunks(spill_dir):
+    """
+    Load the spilled chunks one at a time so only a single chunk is held in memory
+
+    Args:
+        spill_dir (str): Directory the weekend chunks are spilled to
+
+    Yields:
+        pd.DataFrame: The practice statistics for one chunk of weekends
+    """
+    for spill_file in list_spill_files(spill_dir):
+        yield pd.read_pickle(spill_file)
+
+def flush_chunk_buffer(chunk_buffer, spill_dir):
+    """
+    Write the buffered weekends to disk as a single chunk file
+
+    Args:
+        chunk_buffer (list): Buffered practice statistics dataframes, one per weekend
+        spill_dir (str): Directory the weekend chunks are spilled to
+
+    Returns:
+        list: An empty buffer
+    """
+    if not chunk_buffer:
+        return []
+
+    chunk_index = len(list_spill_files(spill_dir))
+    chunk = pd.concat(chunk_buffer)
+    chunk.to_pickle(os.path.join(spill_dir, f'chunk_{chunk_index:05d}.pkl'))
+    return []
+
+def buffer_weekend(chunk_buffer, buffered_bytes, practice_statistics, spill_dir, max_chunk_mb=256):
+    """
+    Add a weekend to the buffer, first spilling the buffer to disk if the weekend would take it over max_chunk_mb
+
+    max_chunk_mb bounds the size of each spilled chunk, not peak memory. Spilling concatenates the buffered
+    weekends into a new frame, and writing the outputs holds a chunk alongside its qualifying and race outputs,
+    so peak memory is roughly 2-3x max_chunk_mb. A single weekend larger than max_chunk_mb becomes its own chunk.
+
+    Args:
+        chunk_buffer (list): Buffered practice statistics dataframes, one per weekend
+        buffered_bytes (int): Running size of the buffer in bytes
+        practice_statistics (pd.DataFrame): The practice statistics for the weekend
+        spill_dir (str): Directory the weekend chunks are spilled to
+        max_chunk_mb (float): Maximum size of a spilled chunk in megabytes
+
+    Returns:
+        tuple: The updated buffer and its size in bytes
+    """
+    weekend_bytes = practice_statistics.memory_usage(deep=True).sum()
+
+    if chunk_buffer and buffered_bytes + weekend_bytes > max_chunk_mb * 1024 * 1024:
+        chunk_buffer = flush_chunk_buffer(chunk_buffer, spill_dir)
+        buffered_bytes = 0
+
+    chunk_buffer.append(practice_statistics)
+    buffered_bytes += weekend_bytes
+    return chunk_buffer, buffered_bytes
+
+def _target_mask(chunk, target_cols):
+    """
+    Mask the rows where every target column is present, treating a missing target column as all NaN
+    """
+    mask = pd.Series(True, index=chunk.index)
+    for col in target_cols:
+        if col not in chunk.columns:
+            return pd.Series(False, index=chunk.index)
+        mask &= chunk[col].notna()
+    return mask
+
+def _compound_values(chunk, mask):
+    """
+    Get the fastest_lap_compound values for the selected rows, as they appear after NaNs are filled with 0
+    """
+    if not mask.any():
+        return set()
+    if 'fastest_lap_compound' not in chunk.columns:
+        return {0}
+    return set(chunk.loc[mask, 'fastest_lap_compound'].fillna(0).unique())
+
+def _compound_categories(values):
+    """
+    Order the compound values the same way pd.get_dummies would over the full column
+    """
+    return pd.get_dummies(pd.Series(list(values), dtype=object)).columns.tolist()
+
+def _order_output_columns(columns, target_cols):
+    """
+    Order the columns as other columns, then ran_ columns, then the target columns
+    """
+    ran_columns = [col for col in columns if 'ran_' in col]
+    other_cols = [col for col in columns if col not in ran_columns and col not in target_cols]
+    return other_cols + ran_columns + target_cols
+
+def _is_numeric(series):
+    """
+    Check if a column holds numbers rather than flags or strings
+    """
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+def scan_chunk_schema(chunks):
+    """
+    First pass over the chunks to find the union of columns, the compound categories of each output
+    and the numeric dtypes, so every chunk can be written with the same columns as a full in-memory build
+
+    Args:
+        chunks (iterable): Practice statistics dataframes, one per chunk
+
+    Returns:
+        dict: The shared columns, numeric dtypes, compound categories and final column order for the qualifying
+            and race outputs
+    """
+    columns = []
+    seen_columns = set()
+    column_counts = {}
+    numeric_dtypes = {}
+    non_numeric = set()
+    n_chunks = 0
+    quali_values = set()
+    race_values = set()
+
+    for chunk in chunks:
+        n_chunks += 1
+        for col in chunk.columns:
+            if col not in seen_columns:
+                seen_columns.add(col)
+                columns.append(col)
+            column_counts[col] = column_counts.get(col, 0) + 1
+            if _is_numeric(chunk[col]):
+                numeric_dtypes.setdefault(col, set()).add(chunk[col].dtype)
+            else:
+                non_numeric.add(col)
+
+        quali_mask = _target_mask(chunk, ['quali_position'])
+        race_mask = _target_mask(chunk, ['quali_position', 'race_position'])
+        quali_values |= _compound_values(chunk, quali_mask)
+        race_values |= _compound_values(chunk, race_mask)
+
+    # Weekends without a quali or race result are still written, so the targets must exist in every chunk
+    for col in ('quali_position', 'race_position'):
+        if col not in seen_columns:
+            columns.append(col)
+
+    # A numeric column takes the dtype it would have after concatenating every chunk, a column missing
+    # from some chunks is filled with NaN there and so becomes float
+    dtypes = {}
+    for col, col_dtypes in numeric_dtypes.items():
+        if col in non_numeric:
+            continue
+        if column_counts[col] < n_chunks:
+            col_dtypes = col_dtypes | {np.dtype('float64')}
+        dtypes[col] = np.result_type(*col_dtypes)
+    for col in ('quali_position', 'race_position'):
+        if col not in column_counts:
+            dtypes[col] = np.dtype('float64')
+
+    quali_categories = _compound_categories(quali_values)
+    race_categories = _compound_categories(race_values)
+
+    base_cols = [col for col in columns if col not in ('fastest_lap_compound', 'quali_position', 'race_position')]
+    quali_dummies = [f'fastest_lap_compound_{category}' for category in quali_categories[1:]]
+    race_dummies = [f'fastest_lap_compound_{category}' for category in race_categories[1:]]
+
+    return {
+        'columns': columns,
+        'dtypes': dtypes,
+        'quali_categories': quali_categories,
+        'race_categories': race_categories,
+        'quali_columns': _order_output_columns(base_cols + quali_dummies, ['quali_position']),
+        'race_columns': _order_output_columns(base_cols + race_dummies, ['quali_position', 'race_position']),
+    }
+
+def _prepare_output(chunk, mask, columns, categories, dtypes):
+    """
+    Select the rows and columns for one output, clean them in place and cast them to the shared dtypes
+    """
+    output = chunk.loc[mask, columns]
+    output = fill_nans_with_zero(output, inplace=True)
+    for col, dtype in dtypes.items():
+        if col in output.columns and output[col].dtype != dtype:
+            output[col] = output[col].astype(dtype)
+    return dummy_fastest_lap_compound(output, categories=categories)
+
+def write_dataset_outputs(chunks, schema, data_dir):
+    """
+    Write the qualifying and race datasets from a single shared pass over the chunks, appending each
+    chunk to both CSVs so only one chunk is held in memory at a time
+
+    Args:
+        chunks (iterable): Practice statistics dataframes, one per chunk
+        schema (dict): The schema returned by scan_chunk_schema
+        data_dir (str): Directory to write the datasets to
+
+    Returns:
+        tuple: The shapes of the qualifying and race datasets
+    """
+    columns = schema['columns']
+    quali_columns = schema['quali_columns']
+    race_columns = schema['race_columns']
+    quali_input_columns = [col for col in columns if col not in ('race_position', 'quali_position')] + ['quali_position']
+    race_input_columns = quali_input_columns + ['race_position']
+
+    quali_path = os.path.join(data_dir, 'qualifying_data.csv')
+    race_path = os.path.join(data_dir, 'race_data.csv')
+    quali_rows = 0
+    race_rows = 0
+
+    for chunk in chunks:
+        if list(chunk.columns) != columns:
+            chunk = chunk.reindex(columns=columns)
+        chunk = check_all_ran_values(chunk)
+
+        quali_mask = _target_mask(chunk, ['quali_position'])
+        race_mask = _target_mask(chunk, ['quali_position', 'race_position'])
+
+        quali_df = _prepare_output(chunk, quali_mask, quali_input_columns, schema['quali_categories'], schema['dtypes'])
+        quali_df.to_csv(quali_path, columns=quali_columns, index=False,
+                        mode='w' if quali_rows == 0 else 'a', header=quali_rows == 0)
+        quali_rows += len(quali_df)
+        del quali_df
+
+        race_df = _prepare_output(chunk, race_mask, race_input_columns, schema['race_categories'], schema['dtypes'])
+        race_df.to_csv(race_path, columns=race_columns, index=False,
+                       mode='w' if race_rows == 0 else 'a', header=race_rows == 0)
+        race_rows += len(race_df)
+        del race_df, chunk
+
+    with open(os.path.join(data_dir, 'qualifying_data_columns.json'), 'w') as f:
+        json.dump(quali_columns, f, indent=4)
+    with open(os.path.join(data_dir, 'race_data_columns.json'), 'w') as f:
+        json.dump(race_columns, f, indent=4)
+
+    return (quali_rows, len(quali_columns)), (race_rows, len(race_columns))
+
+if __name__ == "__main__":
+    import tempfile
+
+    # Regression check: a chunk holding only a weekend without a race result must not break the build
+    weekends = [
+        pd.DataFrame({'driver_number': [1, 44], 'fastest_lap_time': [80.1, 80.4], 'fastest_lap_compound': ['SOFT', 'MEDIUM'],
+                      'ran_SOFT': [True, False], 'quali_position': [1, 2], 'race_position': [2, 1]}),
+        pd.DataFrame({'driver_number': [1, 44], 'fastest_lap_time': [90.2, None], 'fastest_lap_compound': ['HARD', None],
+                      'ran_HARD': [True, False], 'quali_position': [2, None], 'race_position': [1, 3]}),
+        pd.DataFrame({'driver_number': [1, 44], 'fastest_lap_time': [85.0, 85.3], 'fastest_lap_compound': ['SOFT', 'SOFT'],
+                      'ran_SOFT': [True, True], 'quali_position': [1, 2]}),
+    ]
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        spill_dir = os.path.join(data_dir, 'spill')
+        reset_spill_dir(spill_dir)
+        chunk_buffer, buffered_bytes = [], 0
+        for weekend in weekends:
+            chunk_buffer, buffered_bytes = buffer_weekend(chunk_buffer, buffered_bytes, weekend, spill_dir, max_chunk_mb=1e-6)
+        # Each weekend is over the limit, so it is spilled on its own before the next one is buffered
+        assert len(list_spill_files(spill_dir)) == len(weekends) - 1
+        flush_chunk_buffer(chunk_buffer, spill_dir)
+        assert len(list_spill_files(spill_dir)) == len(weekends)
+
+        schema = scan_chunk_schema(iter_spill_chunks(spill_dir))
+        quali_shape, race_shape = write_dataset_outputs(iter_spill_chunks(spill_dir), schema, data_dir)
+        assert quali_shape == (5, len(schema['quali_columns'])), quali_shape
+        assert race_shape == (3, len(schema['race_columns'])), race_shape
+
+        # String columns are filled in place on every pandas version
+        compounds = pd.DataFrame({'fastest_lap_compound': pd.Series(['SOFT', None], dtype='string')})
+        assert fill_nans_with_zero(compounds, inplace=True)['fastest_lap_compound'].tolist() == ['SOFT', 0]
+
+        # Targets are NaN in some chunks, so they are float in every row as in a full in-memory build
+        race_df = pd.read_csv(os.path.join(data_dir, 'race_data.csv'), dtype=str)
+        assert race_df['race_position'].str.endswith('.0').all(), race_df['race_position'].tolist()
+        assert not race_df['driver_number'].str.contains('.', regex=False).any()
+        print(quali_shape, race_shape)
@@ -33,36 +33,53 @@ def remove_nan_target_col(practice_statistics, target_col='quali_position'):
 
     return practice_statistics
 
-def fill_nans_with_zero(practice_statistics):
+def fill_nans_with_zero(practice_statistics, inplace=False):
     """
     Fill any remaining NaNs with 0, these are columns related to tyre compounds that were not run in that overall sessiom,
     but exist in some session in the dataset.
     
     Args:
         practice_statistics (pd.DataFrame): The practice statistics dataframe
+        inplace (bool): Fill the dataframe in place rather than on a copy
 
     Returns:
         pd.DataFrame: The practice statistics dataframe with all NaNs filled with 0
     """
-    practice_statistics = practice_statistics.fillna(0)
+    if inplace:
+        # String columns (e.g. fastest_lap_compound) can't hold 0 in place on newer pandas, so cast them to object first
+        for col in practice_statistics.columns:
+            if pd.api.types.is_string_dtype(practice_statistics[col]) and practice_statistics[col].dtype != object:
+                practice_statistics[col] = practice_statistics[col].astype(object)
+        practice_statistics.fillna(0, inplace=True)
+    else:
+        practice_statistics = practice_statistics.fillna(0)
 
     # If did_appear is in the column name, change the zeros to False
     for col in practice_statistics.columns:
         if 'did_appear' in col:
             practice_statistics.loc[practice_statistics[col] == 0, col] = False
     
-    practice_statistics = practice_statistics.reset_index(drop=True)
+    practice_statistics.reset_index(drop=True, inplace=True)
     return practice_statistics
 
-def dummy_fastest_lap_compound(practice_statistics):
+def dummy_fastest_lap_compound(practice_statistics, categories=None):
     """
     Convert the fastest_lap_compound column to dummy variables
+
+    Args:
+        practice_statistics (pd.DataFrame): The practice statistics dataframe
+        categories (list): The compounds to create dummies for, so chunks of a dataset share the same columns.
+            Defaults to the compounds present in the dataframe
+
+    Returns:
+        pd.DataFrame: The practice statistics dataframe with the fastest_lap_compound column replaced by dummies
     """
-    practice_statistics = practice_statistics.copy()
+    compounds = practice_statistics['fastest_lap_compound']
+    if categories is not None:
+        compounds = pd.Categorical(compounds, categories=categories)
     # Create dummy variables for the fastest_lap_compound column
-    dummies = pd.get_dummies(practice_statistics['fastest_lap_compound'], prefix='fastest_lap_compound', drop_first=True)
-    # Concatenate the dummy variables with the original dataframe
-    practice_statistics = pd.concat([practice_statistics, dummies], axis=1)
-    # Optionally, drop the original fastest_lap_compound column
-    practice_statistics = practice_statistics.drop(columns=['fastest_lap_compound'])
+    dummies = pd.get_dummies(compounds, prefix='fastest_lap_compound', drop_first=True)
+    dummies.index = practice_statistics.index
+    # Drop the original fastest_lap_compound column and concatenate the dummy variables in its place
+    practice_statistics = pd.concat([practice_statistics.drop(columns=['fastest_lap_compound']), dummies], axis=1)
     return practice_statistics